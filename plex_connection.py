@@ -1,5 +1,10 @@
+import hashlib
 import os
+import pickle
+import re
 import sys
+from pathlib import Path
+from typing import Any
 
 from dotenv import load_dotenv
 import plexapi.exceptions
@@ -8,6 +13,56 @@ from plexapi.library import LibrarySection
 import requests
 import yaml
 
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+
+GUID_RE = re.compile(r"plex://(?P<plex>[^\s{}]+)|\{(?P<source>tmdb|imdb|tvdb)-(?P<id>[^}]*)")
+YAML_CACHE_DIR = Path.home().joinpath(".cache", "plex-poster-download")
+
+
+def load_yaml_cached(path: "str | os.PathLike[str]") -> Any:
+    """
+    Load a YAML file, reusing a pickled copy if the file is unchanged since last parsed.
+
+    Each file has a single cache entry, named after its absolute path, which holds the
+    file's modification time and size alongside the parsed contents. The entry is
+    overwritten whenever the file changes.
+
+    Args:
+        path (str | os.PathLike[str]): YAML file to load
+
+    Raises:
+        yaml.YAMLError: if the file is not valid YAML
+
+    Returns:
+        Any: Parsed YAML contents
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    file_version = (stat.st_mtime_ns, stat.st_size)
+    cache_path = YAML_CACHE_DIR.joinpath(f"{hashlib.sha256(str(path).encode()).hexdigest()}.pickle")
+    try:
+        with open(cache_path, "rb") as cache_file:
+            cached_version, cached_data = pickle.load(cache_file)
+        if cached_version == file_version:
+            return cached_data
+    except (OSError, pickle.UnpicklingError, EOFError, TypeError, ValueError):
+        pass
+
+    with open(path, encoding="utf-8") as yaml_file:
+        data = yaml.load(yaml_file, Loader=YamlLoader)
+    try:
+        YAML_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "wb") as cache_file:
+            pickle.dump((file_version, data), cache_file, protocol=5)
+    except OSError:
+        # Caching is best effort only
+        pass
+    return data
+
 
 class PlexConnection:
     """Connect to Plex libraries."""
@@ -65,26 +120,24 @@ class PlexConnection:
                     'Please check the server IP addresses in .env, and consult the README.'
                 )
 
-        with open("./config.yml", encoding="utf-8") as config_file:
-            try:
-                config_yaml = yaml.safe_load(config_file)
-            except yaml.YAMLError as err:
-                print(err)
+        try:
+            config_yaml = load_yaml_cached("./config.yml")
+        except yaml.YAMLError as err:
+            print(err)
         self.libraries = [*config_yaml["libraries"]]
 
         self.collections_config = {}
         if edit_collections:
             for lib in config_yaml["libraries"]:
                 for coll_file in config_yaml["libraries"][lib]["collection_files"]:
-                    with open(coll_file["file"], "r", encoding="utf-8") as collection_config_file:
-                        try:
-                            colls = yaml.safe_load(collection_config_file)
-                            if self.collections_config.get(lib):
-                                self.collections_config[lib].update(colls["collections"])
-                            else:
-                                self.collections_config[lib] = colls["collections"]
-                        except yaml.YAMLError as err:
-                            print(err)
+                    try:
+                        colls = load_yaml_cached(coll_file["file"])
+                        if self.collections_config.get(lib):
+                            self.collections_config[lib].update(colls["collections"])
+                        else:
+                            self.collections_config[lib] = colls["collections"]
+                    except yaml.YAMLError as err:
+                        print(err)
 
     def plex_setup(self) -> None:
         """
@@ -162,15 +215,17 @@ class PlexConnection:
                 "movie": ["tmdb", "imdb", "plex"],
                 "show": ["tvdb", "tmdb", "plex"]
             }
-            for source in lib_sources[lib_type]:
-                if title.find(source) == -1:
-                    # source not found in title
-                    continue
-                if source == "plex":
-                    guid = title.split(sep="plex://")[-1].split()[0]
+            sources = lib_sources[lib_type]
+            # Collect every GUID in one pass, then pick by source priority
+            found: dict[str, str] = {}
+            for match in GUID_RE.finditer(title):
+                if match["plex"] is not None:
+                    found["plex"] = match["plex"]
                 else:
-                    guid = title.split(sep=f"{{{source}-")[-1].split(sep="}")[0]
-
+                    found[match["source"]] = match["id"]
+            for source in sources:
+                if (guid := found.get(source)) is None:
+                    continue
                 if full:
                     return f"{source}://{guid}"
                 return guid
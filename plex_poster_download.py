@@ -8,7 +8,7 @@ directory.
 
 Original Author: Blacktwin
 Revised: averageyogi
-Requires: plexapi, dotenv, tqdm
+Requires: plexapi, dotenv, requests, tqdm
 
  Example:
     python plex_poster_download.py <save_path>
@@ -17,15 +17,18 @@ Requires: plexapi, dotenv, tqdm
 
 import os
 import re
+import shutil
 import argparse
-import urllib.request
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Iterator, Optional, TypedDict
+from xml.etree import ElementTree
 
 from dotenv import load_dotenv
+import requests
+from requests.adapters import HTTPAdapter, Retry
 from plexapi.library import LibrarySection
-from plexapi.video import Show, Movie
-from plexapi.audio import Artist, Album
+from plexapi.server import PlexServer
 from tqdm import tqdm
 
 from plex_connection import PlexConnection
@@ -33,123 +36,300 @@ from plex_connection import PlexConnection
 
 load_dotenv(override=True)  # Take environment variables from .env
 
-def create_save_path(
-    save_path: Optional[Path], library: tuple[str, LibrarySection], name: str
-) -> Path:
+MAX_WORKERS = 16
+MAX_PENDING = 2 * MAX_WORKERS  # Downloads queued or running at once
+MAX_RETRIES = 3
+REQUEST_TIMEOUT = 30  # seconds
+COPY_BUFFER_SIZE = 1024 * 1024
+
+NONWORD_RE = re.compile(r"\W+")
+
+# Shared session so library enumeration and poster downloads reuse pooled
+# keep-alive connections. Each host's pool keeps one connection per download
+# worker, plus one for the library item stream, so no connection is discarded.
+# Throttled (429) and failed requests are retried, honoring Retry-After.
+adapter = HTTPAdapter(
+    pool_maxsize=MAX_WORKERS + 1,
+    max_retries=Retry(total=MAX_RETRIES, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+)
+session = requests.Session()
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+session.headers["Connection"] = "keep-alive"
+
+# Filenames taken in each save directory, scanned once per directory, and the
+# next "_i" suffix to try per (directory, name). Names are casefolded so that
+# names differing only by case are still unique on case-insensitive filesystems
+taken_filenames: dict[Path, set[str]] = {}
+next_index: dict[tuple[Path, str], int] = {}
+
+class LibraryItem(TypedDict):
+    """Poster-relevant attributes of a Plex library item, as given in the section XML."""
+    title: str
+    year: Optional[str]
+    thumb: Optional[str]
+    updatedAt: Optional[str]
+
+def library_save_dir(save_path: Optional[Path], library_name: str) -> Path:
     """
-    Create save directory and unique path.
+    Get the directory posters of a library are saved in.
 
     Args:
         save_path (Optional[Path]): Path to save posters
-        library (LibrarySection): Plex library
+        library_name (str): Plex library name
+
+    Returns:
+        Path: Library save directory
+    """
+    if save_path is not None:
+        return save_path.joinpath(library_name)
+    # Create path for library posters inside current directory
+    return Path.cwd().joinpath(f"Posters/{library_name}")
+
+def create_save_path(save_dir_path: Path, name: str, rename_existing: bool = True) -> Path:
+    """
+    Create unique save path.
+
+    Args:
+        save_dir_path (Path): Existing directory to save posters in
         name (str): Media's name for poster
+        rename_existing (bool, optional): If true, files already on disk count as taken and the new path gets
+            an index appended. If false, only paths handed out during this run are avoided, so an existing
+            poster's path is reused. Defaults to True.
 
     Returns:
         Path: Unique save path
     """
-    if save_path is not None:
-        save_dir_path = save_path.joinpath(library[0])
-    else:
-        # Create path for library posters inside current directory
-        save_dir_path = Path.cwd().joinpath(f"Posters/{library[0]}")
-    os.makedirs(save_dir_path, exist_ok=True)
-    image_path = save_dir_path.joinpath(f"{name}.png")
+    if (taken := taken_filenames.get(save_dir_path)) is None:
+        if rename_existing:
+            with os.scandir(save_dir_path) as entries:
+                taken = taken_filenames[save_dir_path] = {entry.name.casefold() for entry in entries}
+        else:
+            taken = taken_filenames[save_dir_path] = set()
 
     # Check if file already exists and append index if so
-    if image_path.exists():
-        i = 1
-        while image_path.with_stem(f"{name}_{i}").exists():
+    filename = f"{name}.png"
+    if filename.casefold() in taken:
+        key = (save_dir_path, name.casefold())
+        i = next_index.get(key, 1)
+        while (filename := f"{name}_{i}.png").casefold() in taken:
             i += 1
-        image_path = image_path.with_stem(f"{name}_{i}")
+        next_index[key] = i + 1
+    taken.add(filename.casefold())
 
-    return image_path
+    return save_dir_path.joinpath(filename)
+
+def iter_library_items(
+    server: PlexServer, section: LibrarySection, on_total: Optional[Callable[[int], None]] = None
+) -> Iterator[LibraryItem]:
+    """
+    Yield all poster-bearing items of a library from a single streamed section request.
+
+    The section XML is parsed incrementally, skipping PlexAPI object construction,
+    so downloads can start before the whole library is read. Music libraries are
+    fetched at the album level directly, rather than walking each artist's albums
+    with a request per artist.
+
+    Args:
+        server (PlexServer): Connected Plex server
+        section (LibrarySection): Plex library
+        on_total (Callable[[int],None], optional): Called with the number of items in the library once the
+            server reports it, before any item is yielded. Defaults to None.
+
+    Yields:
+        LibraryItem: Library items
+    """
+    if section.type == "artist":
+        ekey = f"/library/sections/{section.key}/albums"
+    else:
+        ekey = f"/library/sections/{section.key}/all"
+    url = server.url(f"{ekey}?checkFiles=0&includeChildren=0&includeAllConcerts=0", includeToken=True)
+
+    with session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        for event, element in ElementTree.iterparse(response.raw, events=("start", "end")):
+            if event == "start":
+                if element.tag == "MediaContainer" and on_total is not None:
+                    total = element.get("totalSize") or element.get("size")
+                    if total is not None:
+                        on_total(int(total))
+                continue
+            if element.tag not in ("Video", "Directory"):
+                continue
+            yield {
+                "title": element.get("title", ""),
+                "year": element.get("year"),
+                "thumb": element.get("thumb"),
+                "updatedAt": element.get("updatedAt"),
+            }
+            element.clear()
 
 def grab_url(
-    lib_item: Union[Album, Movie, Show], plex: PlexConnection, video_lib: bool
+    lib_item: LibraryItem, server_url: str, token_query: str, video_lib: bool
 ) -> tuple[str, str]:
     """
     Clean item name and get plex library URL of poster.
 
     Args:
-        lib_item (Union[Album, Movie, Show]): Particular plex library item
-        plex (PlexConnection): Plex connection
+        lib_item (LibraryItem): Particular plex library item
+        server_url (str): Plex server address to pull posters from
+        token_query (str): Query string authenticating the request, "?X-Plex-Token=[token]"
         video_lib (bool): whether or not item is from a video library, for naming convention
 
     Returns:
         tuple[str,str]: (new filename, poster URL)
     """
     # Clean names of special characters
-    name = re.sub('\\W+', ' ', lib_item.title)
+    name = NONWORD_RE.sub(" ", lib_item["title"])
     if video_lib:  # Add (year) to name
-        name = f"{name} ({lib_item.year})"
+        name = f"{name} ({lib_item['year']})"
     # Pull URL for poster
-    thumb_url = (
-        # f'{os.environ["PLEX_SERVER_PUBLIC_IP"]}{lib_item.images[0].url}'
-        f'{plex.plex_pub_ip if not plex.using_public_ip else plex.plex_ip}{lib_item.images[0].url}'
-        f'?X-Plex-Token={os.environ["PLEX_TOKEN"]}'
-    )
+    thumb_url = f"{server_url}{lib_item['thumb']}{token_query}"
     return name, thumb_url
 
-def main(save_path: Optional[Path] = None):
+def is_up_to_date(image_path: Path, lib_item: LibraryItem) -> bool:
+    """
+    Check if a previously downloaded poster can be kept as is.
+
+    Args:
+        image_path (Path): Poster save path
+        lib_item (LibraryItem): Plex library item the poster belongs to
+
+    Returns:
+        bool: True if the file exists, is non-empty, and is not older than the item's last update
+    """
+    try:
+        stat = image_path.stat()
+    except FileNotFoundError:
+        return False
+    if stat.st_size == 0:
+        return False
+    return lib_item["updatedAt"] is None or stat.st_mtime >= int(lib_item["updatedAt"])
+
+def iter_tasks(
+    server: PlexServer,
+    section: LibrarySection,
+    save_dir_path: Path,
+    server_url: str,
+    token_query: str,
+    force: bool = False,
+    progress: Optional[tqdm] = None,
+) -> Iterator[tuple[str, Path]]:
+    """
+    Yield a download task for each poster of a library that needs saving.
+
+    Unique save paths are assigned here serially, so parallel workers consuming
+    the tasks never race on the same filename.
+
+    Args:
+        server (PlexServer): Connected Plex server
+        section (LibrarySection): Plex library
+        save_dir_path (Path): Existing directory to save the library's posters in
+        server_url (str): Plex server address to pull posters from
+        token_query (str): Query string authenticating the request, "?X-Plex-Token=[token]"
+        force (bool, optional): If true, yield every poster, even those already saved. Defaults to False.
+        progress (tqdm, optional): Progress bar to size to the library, advanced here for items that are not
+            yielded. Defaults to None.
+
+    Yields:
+        tuple[str,Path]: (poster URL, save path)
+    """
+    def set_total(total: int) -> None:
+        if progress is not None:
+            progress.total = total
+            progress.refresh()
+
+    def skip() -> None:
+        if progress is not None:
+            progress.update()
+
+    video_lib = section.type in ["movie", "show"]
+    for lib_item in iter_library_items(server, section, on_total=set_total):
+        if lib_item["thumb"] is None:
+            skip()
+            continue
+        name, thumb_url = grab_url(lib_item, server_url, token_query, video_lib=video_lib)
+        image_path = create_save_path(save_dir_path, name, rename_existing=force)
+        if not force and is_up_to_date(image_path, lib_item):
+            skip()
+            continue
+        yield thumb_url, image_path
+
+def download_images(task: tuple[str, Path]) -> None:
+    """
+    Download a single poster image to disk.
+
+    Args:
+        task (tuple[str,Path]): (poster URL, save path)
+    """
+    thumb_url, image_path = task
+    # Download to a temporary file first, so an interrupted download never
+    # leaves a partial poster that later runs would treat as up to date
+    part_path = image_path.with_name(f"{image_path.name}.part")
+    try:
+        with session.get(thumb_url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(part_path, "wb") as image_file:
+                shutil.copyfileobj(response.raw, image_file, length=COPY_BUFFER_SIZE)
+        os.replace(part_path, image_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+def main(save_path: Optional[Path] = None, force: bool = False):
     """
     Saves the posters of items in Plex libraries.
 
     Args:
         save_path (Path, optional): Path to save posters. Defaults to None.
+        force (bool, optional): If true, download every poster, saving alongside existing files with an index
+            appended. If false, skip posters already saved and unchanged in Plex since. Defaults to False.
     """
     print("Loading Plex config...")
     plex = PlexConnection(edit_collections=False)
     plex_libraries = plex.get_libraries()
+    # Prefer the public address for poster URLs, falling back to the only one given
+    server_url = plex.plex_pub_ip or plex.plex_ip
+    token_query = f"?X-Plex-Token={plex.plex_token}"
 
     save_dir_path = ""
     for library in plex_libraries.items():
         if library[1].type == "photo":
             print("This function does not handle photo libraries.")
             continue
-        if library[1].type in ["movie", "show"]:
-            lib_type = "video"
-        elif library[1].type == "artist":
-            lib_type = "audio"
-        else:
+        if library[1].type not in ["movie", "show", "artist"]:
             print("Unknown library type.")
             continue
+        save_dir_path = library_save_dir(save_path, library[0])
+        save_dir_path.mkdir(parents=True, exist_ok=True)
 
-        if lib_type == "audio":
-            artist: Artist
-            for artist in tqdm(
-                library[1].all(),
-                total=library[1].totalSize,
-                ascii=" ░▒█",
-                ncols=100,
-                desc=library[0],
-                unit=library[1].type
-            ):
-                # Audio libraries have multiple layers in the API
-                album: Album
-                for album in artist.albums():
-                    if album.thumb is None:
-                        continue
-                    name, thumb_url = grab_url(album, plex, video_lib=False)
-                    image_path = create_save_path(save_path, library, name)
-                    urllib.request.urlretrieve(thumb_url, image_path)
-                    save_dir_path = image_path.parent
-
-        else:  # lib_type = "video"
-            video: Union[Movie, Show]
-            for video in tqdm(
-                library[1].all(),
-                total=library[1].totalSize,
-                ascii=" ░▒█",
-                ncols=100,
-                desc=library[0],
-                unit=library[1].type
-            ):
-                if video.thumb is None:
-                    continue
-                name, thumb_url = grab_url(video, plex, video_lib=True)
-                image_path = create_save_path(save_path, library, name)
-                urllib.request.urlretrieve(thumb_url, image_path)
-                save_dir_path = image_path.parent
+        # Downloads are queued as items stream in from the library, with the queue
+        # bounded so a failure or Ctrl-C cancels the rest instead of waiting on them.
+        # Finished downloads are collected here, so the progress bar is only ever
+        # updated from this thread
+        with (
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor,
+            tqdm(ascii=" ░▒█", ncols=100, desc=library[0], unit="poster") as progress,
+        ):
+            pending: set[Future] = set()
+            try:
+                for task in iter_tasks(
+                    plex.plex, library[1], save_dir_path, server_url, token_query, force, progress
+                ):
+                    if len(pending) >= MAX_PENDING:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for download in done:
+                            download.result()  # Raise any download errors
+                            progress.update()
+                    pending.add(executor.submit(download_images, task))
+                for download in as_completed(pending):
+                    download.result()
+                    progress.update()
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
     print(f"Saved to {save_dir_path}")
 
 
@@ -158,6 +338,10 @@ if __name__ == "__main__":
     parser.add_argument(
         "save_path", nargs='?', type=Path, default=None, help="Path to save posters at, optional, default is cwd",
     )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Download all posters, even those already saved. Existing files are kept and new ones indexed",
+    )
     args = parser.parse_args()
 
-    main(args.save_path)
+    main(args.save_path, args.force)